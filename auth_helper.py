@@ -2,6 +2,10 @@ import requests
 import config
 import urllib.parse
 
+from main import REQUEST_TIMEOUT, build_session, decode_json
+
+SESSION = build_session()
+
 def step_one_get_authorization_url():
     params = {
         "client_id": config.CLIENT_ID,
@@ -29,9 +33,9 @@ def step_two_exchange_code(code):
     }
     
     try:
-        response = requests.post(config.AUTH_URL, data=payload)
+        response = SESSION.post(config.AUTH_URL, data=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
+        data = decode_json(response)
         
         print("\nAuthentication Successful!")
         print(f"New Refresh Token: {data['refresh_token']}")
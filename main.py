@@ -1,31 +1,67 @@
 import requests
+import hashlib
+import json
+import math
 import os
 import sys
+import threading
 import time
 import argparse
 import tempfile
+from collections import OrderedDict
 from datetime import datetime
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
-# Load environment variables
-load_dotenv()
-
-# Configuration
-CLIENT_ID = os.getenv("STRAVA_CLIENT_ID")
-CLIENT_SECRET = os.getenv("STRAVA_CLIENT_SECRET")
-REFRESH_TOKEN = os.getenv("STRAVA_REFRESH_TOKEN")
-
-AUTH_URL = "https://www.strava.com/oauth/token"
-API_URL = "https://www.strava.com/api/v3"
-OUTPUT_FILE = "entrenamientos_contexto.txt"
+from config import (
+    API_URL,
+    AUTH_URL,
+    CLIENT_ID,
+    CLIENT_SECRET,
+    OUTPUT_FILE,
+    REFRESH_TOKEN,
+)
+
+# orjson decodes Strava's larger payloads 2-3x faster than stdlib json,
+# but the script stays functional without it.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Marker separating activities in the output file: '<!-- ID: N -->'.
+ID_MARKER_PREFIX = '<!-- ID: '
+ID_MARKER_SUFFIX = ' -->'
 
 # Rate Limit Safety
-API_CALLS = 0
-MAX_API_CALLS = 80
+# Client-side token buckets model Strava's real quota windows; the
+# X-RateLimit-* headers reported on every response stay authoritative.
+RATE_SHORT_CAPACITY = 100
+RATE_SHORT_WINDOW = 900
+RATE_DAILY_CAPACITY = 1000
+RATE_DAILY_WINDOW = 86400
+RATE_LIMIT_HEADROOM = 2
 REQUEST_TIMEOUT = (10, 30)
 
+# Concurrent detail fetches; matches the adapter's pool_maxsize so every
+# worker reuses a pooled connection instead of opening a new one.
+MAX_DETAIL_WORKERS = 4
+
+# Splits and zones are only rendered from this activity onwards; older
+# entries keep their original short format.
+ZONES_MIN_ACTIVITY_ID = 17347409698
+
+# Strava access tokens live ~6 hours; cache them so hourly cron runs skip
+# the OAuth round trip. The margin avoids using a token about to expire.
+TOKEN_CACHE_FILE = ".strava_token.json"
+TOKEN_EXPIRY_MARGIN = 60
+
+# ETags of previously fetched detail payloads; conditional GETs answer
+# 304 with an empty body when an activity is unchanged.
+CACHE_FILE = ".strava_cache.json"
+
 
 class StravaSyncError(RuntimeError):
     """Raised when a sync cannot be completed without risking partial data."""
@@ -42,7 +78,7 @@ def build_session():
         allowed_methods=frozenset({'GET', 'POST'}),
         respect_retry_after_header=True,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
     session = requests.Session()
     session.mount('https://', adapter)
     return session
@@ -51,6 +87,13 @@ def build_session():
 SESSION = build_session()
 
 
+def decode_json(response):
+    """Decodes a response body, preferring orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
 def require_credentials():
     missing = [
         name for name, value in (
@@ -66,18 +109,121 @@ def require_credentials():
         )
 
 
-def reserve_api_call():
-    global API_CALLS
-    if API_CALLS >= MAX_API_CALLS:
-        raise StravaSyncError(
-            f"Rate limit safety cap reached ({MAX_API_CALLS} API calls). "
-            "No output file was changed."
+@dataclass(slots=True)
+class TokenBucket:
+    """Token bucket where take() returns the wait (seconds) before proceeding.
+
+    Tokens may go negative so queued callers space themselves out at the
+    refill rate instead of bursting past the budget.
+    """
+    capacity: float
+    refill_per_sec: float
+    tokens: float = None
+    last_refill: float = None
+
+    def __post_init__(self):
+        if self.tokens is None:
+            self.tokens = self.capacity
+        if self.last_refill is None:
+            self.last_refill = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.last_refill) * self.refill_per_sec,
         )
-    API_CALLS += 1
+        self.last_refill = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_per_sec
+
+
+@dataclass(slots=True)
+class RateState:
+    """API-call budget for one sync run, shared across fetch workers."""
+    usage_short: int | None = None
+    limit_short: int | None = None
+    short_bucket: TokenBucket = field(default_factory=lambda: TokenBucket(
+        RATE_SHORT_CAPACITY, RATE_SHORT_CAPACITY / RATE_SHORT_WINDOW))
+    daily_bucket: TokenBucket = field(default_factory=lambda: TokenBucket(
+        RATE_DAILY_CAPACITY, RATE_DAILY_CAPACITY / RATE_DAILY_WINDOW))
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def update_from_response(self, response):
+        """Records the 15-minute usage/limit Strava reports on every response."""
+        usage = response.headers.get('X-RateLimit-Usage')
+        limit = response.headers.get('X-RateLimit-Limit')
+        if not usage or not limit:
+            return
+        try:
+            with self.lock:
+                self.usage_short = int(usage.split(',')[0])
+                self.limit_short = int(limit.split(',')[0])
+                # Other processes on the same token also consume budget;
+                # drain the bucket down to what Strava says is left.
+                self.short_bucket.tokens = min(
+                    self.short_bucket.tokens,
+                    self.limit_short - self.usage_short,
+                )
+        except ValueError:
+            pass
+
+    def reserve(self):
+        with self.lock:
+            if self.usage_short is not None and self.limit_short is not None:
+                if self.limit_short - self.usage_short < RATE_LIMIT_HEADROOM:
+                    raise StravaSyncError(
+                        f"Strava rate limit nearly exhausted "
+                        f"({self.usage_short}/{self.limit_short} calls in the "
+                        "15-minute window). No output file was changed."
+                    )
+            wait = max(self.short_bucket.take(), self.daily_bucket.take())
+        if wait > 0:
+            time.sleep(wait)
+
+def load_cached_token():
+    """Returns the cached access token if it is still comfortably valid."""
+    try:
+        with open(TOKEN_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if time.time() < data['expires_at'] - TOKEN_EXPIRY_MARGIN:
+            return data['access_token']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
 
-def get_access_token():
-    """Refreshes the access token using the refresh token."""
+def save_cached_token(token_data):
+    """Caches the token atomically with owner-only permissions. Best effort."""
+    if not token_data.get('expires_at'):
+        return
+    try:
+        with tempfile.NamedTemporaryFile(
+            mode='w', encoding='utf-8',
+            dir=os.path.dirname(TOKEN_CACHE_FILE) or '.', delete=False,
+        ) as f:
+            temp_path = f.name
+            json.dump({
+                'access_token': token_data['access_token'],
+                'expires_at': token_data['expires_at'],
+            }, f)
+        os.chmod(temp_path, 0o600)
+        os.replace(temp_path, TOKEN_CACHE_FILE)
+    except OSError as error:
+        print(f"Warning: could not cache the access token: {error}")
+
+
+def get_access_token(state):
+    """Returns a valid access token, refreshing and caching it when needed."""
     require_credentials()
+
+    cached = load_cached_token()
+    if cached:
+        SESSION.headers['Authorization'] = f"Bearer {cached}"
+        return cached
+
     payload = {
         'client_id': CLIENT_ID,
         'client_secret': CLIENT_SECRET,
@@ -86,12 +232,16 @@ def get_access_token():
     }
     
     try:
-        reserve_api_call()
+        state.reserve()
         response = SESSION.post(AUTH_URL, data=payload, timeout=REQUEST_TIMEOUT)
+        state.update_from_response(response)
         response.raise_for_status()
-        token_data = response.json()
+        token_data = decode_json(response)
         if not token_data.get('access_token'):
             raise StravaSyncError('Strava token response did not include an access token.')
+        save_cached_token(token_data)
+        # Every later call rides the session, so set the header once here.
+        SESSION.headers['Authorization'] = f"Bearer {token_data['access_token']}"
         return token_data['access_token']
     except (requests.exceptions.RequestException, ValueError) as error:
         detail = getattr(locals().get('response'), 'text', '')
@@ -101,98 +251,180 @@ def get_access_token():
             f"Unable to refresh the Strava token: {error}.{detail}"
         ) from error
 
-def get_activities(access_token, fetch_all=False, limit=10):
+def get_activities(state, fetch_all=False, limit=30,
+                   filter_types=frozenset({"WeightTraining"})):
     """
-    Fetches activities from Strava.
-    If fetch_all is True, paginates through all history.
-    Otherwise, fetches the most recent 'limit' activities.
+    Fetches activities from Strava, dropping filter_types as pages arrive
+    so excluded entries never reach the detail pipeline.
+    If fetch_all is True, paginates through all history. Otherwise, pages
+    until 'limit' kept activities (or the history runs out). A wider
+    default window is cheap: the list call costs the same per page, and
+    unchanged activities never reach the detail fetch thanks to the
+    summary-skip and ETag checks downstream.
     """
-    global API_CALLS
-    headers = {'Authorization': f"Bearer {access_token}"}
-    activities = []
-    page = 1
-    per_page = 200 if fetch_all else limit
-    
-    while True:
-        params = {'per_page': per_page, 'page': page}
+    def fetch_page(page, per_page):
         try:
             print(f"Fetching page {page}...")
-            reserve_api_call()
+            state.reserve()
             response = SESSION.get(
                 f"{API_URL}/athlete/activities",
-                headers=headers,
-                params=params,
+                params={'per_page': per_page, 'page': page},
                 timeout=REQUEST_TIMEOUT,
             )
+            state.update_from_response(response)
             response.raise_for_status()
-            batch = response.json()
-            
-            if not batch:
-                break
-                
-            activities.extend(batch)
-            
-            if not fetch_all:
-                break
-                
-            page += 1
-            
+            return decode_json(response)
         except (requests.exceptions.RequestException, ValueError) as error:
             raise StravaSyncError(
                 f"Unable to fetch activities on page {page}: {error}"
             ) from error
-            
-    return activities
 
-def get_activity_detail(activity_id, access_token):
-    """Fetches detailed activity data to get fields like perceived_exertion."""
-    headers = {'Authorization': f"Bearer {access_token}"}
+    activities = []
+    page = 1
+    per_page = 200 if fetch_all else limit
+    while True:
+        batch = fetch_page(page, per_page)
+        if not batch:
+            return activities
+        activities.extend(
+            a for a in batch
+            if a.get('sport_type', a.get('type', 'Unknown')) not in filter_types
+        )
+        # The common daily sync stops as soon as 'limit' activities
+        # survive the filter; a short page means the history ended.
+        if not fetch_all and (len(activities) >= limit or len(batch) < per_page):
+            return activities[:limit]
+        page += 1
+
+def description_hash(description):
+    """64-bit blake2b digest of a description, for cheap change comparison."""
+    digest = hashlib.blake2b(description.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def load_cache():
+    """Loads the ETag and description-hash maps. Missing or bad cache means empty maps."""
+    try:
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            etags = {int(act_id): etag for act_id, etag in data.get('etags', {}).items()}
+            hashes = {int(act_id): value for act_id, value in data.get('desc_hashes', {}).items()}
+            return etags, hashes
+    except (OSError, ValueError):
+        pass
+    return {}, {}
+
+
+def save_cache(etags, desc_hashes):
+    """Persists the sync cache. Best effort: losing it only costs re-downloads."""
+    try:
+        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    'etags': {str(act_id): etag for act_id, etag in etags.items()},
+                    'desc_hashes': {str(act_id): value for act_id, value in desc_hashes.items()},
+                },
+                f,
+            )
+    except OSError as error:
+        print(f"Warning: could not write the sync cache: {error}")
+
+
+def get_activity_detail(activity_id, state, etag=None):
+    """Fetches detailed activity data to get fields like perceived_exertion.
+
+    Returns (detail, etag). With a cached etag the request is conditional;
+    a 304 answer yields (None, etag), meaning the stored data is current.
+    """
     try:
-        reserve_api_call()
+        state.reserve()
         response = SESSION.get(
             f"{API_URL}/activities/{activity_id}",
-            headers=headers,
+            headers={'If-None-Match': etag} if etag else None,
             timeout=REQUEST_TIMEOUT,
         )
+        state.update_from_response(response)
+        if response.status_code == 304:
+            return None, etag
         response.raise_for_status()
-        return response.json()
+        return decode_json(response), response.headers.get('ETag')
     except (requests.exceptions.RequestException, ValueError) as error:
         raise StravaSyncError(
             f"Unable to fetch details for activity {activity_id}: {error}"
         ) from error
 
-def get_zones(activity_id, access_token):
+def get_zones(activity_id, state):
     """Fetches heart rate and pace zones for an activity."""
-    headers = {'Authorization': f"Bearer {access_token}"}
     try:
-        reserve_api_call()
+        state.reserve()
         response = SESSION.get(
             f"{API_URL}/activities/{activity_id}/zones",
-            headers=headers,
             timeout=REQUEST_TIMEOUT,
         )
+        state.update_from_response(response)
         if response.status_code == 404:
             return []
         response.raise_for_status()
-        return response.json()
+        return decode_json(response)
     except (requests.exceptions.RequestException, ValueError) as error:
         raise StravaSyncError(
             f"Unable to fetch zones for activity {activity_id}: {error}"
         ) from error
 
+def fetch_full_activity(act_id, state, etag=None):
+    """Fetches an activity's detail payload, plus zones for recent ones.
+
+    Returns (detail, etag); detail is None when a conditional request
+    reported the activity unchanged, in which case zones are skipped too.
+    """
+    detail, new_etag = get_activity_detail(act_id, state, etag)
+    if detail is None:
+        return None, new_etag
+    try:
+        wants_zones = act_id >= ZONES_MIN_ACTIVITY_ID
+    except TypeError:
+        wants_zones = False
+    if wants_zones:
+        zones = get_zones(act_id, state)
+        if zones:
+            detail['zones'] = zones
+    return detail, new_etag
+
+def fetch_details(activity_ids, state, etags=None):
+    """Fetches detail (and zones) payloads for several activities concurrently.
+
+    Returns a dict mapping activity id to a (detail, etag) pair. Any failed
+    fetch aborts the whole batch so a partial sync is never written.
+    """
+    if not activity_ids:
+        return {}
+    etags = etags or {}
+    workers = min(MAX_DETAIL_WORKERS, len(activity_ids))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        details = pool.map(
+            lambda act_id: fetch_full_activity(act_id, state, etags.get(act_id)),
+            activity_ids,
+        )
+        return dict(zip(activity_ids, details))
+
+# RPE (1-10) to description; index 0 is unused.
+_RPE_TABLE = (None, "Suave", "Suave", "Suave", "Moderado", "Moderado",
+              "Moderado", "Duro", "Duro", "Muy duro", "Máximo")
+
 def get_rpe_description(rpe):
-    """Maps RPE value (1-10) to a text description."""
-    if not rpe:
-        return None
+    """Maps RPE value (1-10) to a text description.
+
+    The value is rounded up to int and clamped into [0, 10], matching the
+    original threshold chain (e.g. 3.5 reads as 'Moderado'); anything
+    above 10 reads as 'Máximo' and anything at 0 or below as no
+    description.
+    """
     try:
-        val = float(rpe)
-        if val <= 3: return "Suave"
-        if val <= 6: return "Moderado"
-        if val <= 8: return "Duro"
-        if val <= 9: return "Muy duro"
-        return "Máximo"
+        val = math.ceil(float(rpe))
     except (ValueError, TypeError):
         return None
+    return _RPE_TABLE[max(0, min(10, val))]
 
 def format_pace(seconds, distance_km):
     """Calculates pace in min/km."""
@@ -204,8 +436,13 @@ def format_pace(seconds, distance_km):
     pace_sec = int((pace_decimal - pace_min) * 60)
     return f"{pace_min}:{pace_sec:02d}"
 
-def format_activity(activity):
-    """Formats an activity into a natural language description."""
+def format_activity(activity, include_details=True):
+    """Formats an activity into a natural language description.
+
+    With include_details=False only summary-derived fields (base line,
+    cadence, heart rate) are rendered, so the result is comparable against
+    a stored description without fetching the detail payload.
+    """
     # Extract data with safe defaults
     name = activity.get('name', 'Actividad')
     date_str = activity.get('start_date_local', '')
@@ -220,10 +457,9 @@ def format_activity(activity):
     perceived_exertion = activity.get('perceived_exertion')
     
     # Check if we should add detailed info (Splits & Zones)
-    # Target ID: 17347409698. Future IDs will be larger.
     show_details = False
     try:
-        if activity.get('id') and int(activity.get('id')) >= 17347409698:
+        if include_details and activity.get('id') and int(activity.get('id')) >= ZONES_MIN_ACTIVITY_ID:
             show_details = True
     except (ValueError, TypeError):
         pass
@@ -233,26 +469,33 @@ def format_activity(activity):
     distance_km = distance_meters / 1000
     
     # Format date (e.g., 2026-02-07T10:00:00Z -> 07/02/2026)
-    try:
-        date_obj = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-        formatted_date = date_obj.strftime("%d/%m/%Y")
-    except (ValueError, TypeError):
-        formatted_date = date_str
+    # start_date_local always has the fixed ISO-8601 shape, so slicing
+    # replaces a full datetime parse-and-reformat round trip; anything
+    # that fails the shape check takes the slow parse before giving up.
+    if (isinstance(date_str, str) and len(date_str) >= 10
+            and date_str[4] == '-' and date_str[7] == '-'):
+        formatted_date = f"{date_str[8:10]}/{date_str[5:7]}/{date_str[0:4]}"
+    else:
+        try:
+            date_obj = datetime.fromisoformat(str(date_str).replace('Z', '+00:00'))
+            formatted_date = date_obj.strftime("%d/%m/%Y")
+        except (ValueError, TypeError):
+            formatted_date = date_str
 
     # Format time
     if moving_time_seconds < 3600:
         time_str = f"{moving_time_seconds // 60} minutos"
     else:
-        hours = moving_time_seconds // 3600
-        minutes = (moving_time_seconds % 3600) // 60
-        time_str = f"{hours}h {minutes}min"
+        hours, remainder = divmod(moving_time_seconds, 3600)
+        time_str = f"{hours}h {remainder // 60}min"
 
     # Calculate pace
     pace_str = format_pace(moving_time_seconds, distance_km)
 
-    # Base description
-    description = f"El {formatted_date} realicé una {type_} de {distance_km:.1f}km en {time_str} con {elevation:.0f}m de desnivel. Mi ritmo medio fue de {pace_str} min/km."
-    
+    # Strings are immutable, so repeated += would copy the whole
+    # description on every section; collect parts and join once instead.
+    parts = [f"El {formatted_date} realicé una {type_} de {distance_km:.1f}km en {time_str} con {elevation:.0f}m de desnivel. Mi ritmo medio fue de {pace_str} min/km."]
+
     # Add Cadence
     # For running (Run), Strava API returns 2x steps per minute usually, or sometimes steps/min directly?
     # Actually for running, 'average_cadence' in API is often full steps per minute (e.g. 170).
@@ -264,25 +507,26 @@ def format_activity(activity):
     if avg_cadence:
         if type_ == "Run":
             spm = avg_cadence * 2
-            description += f" Cadencia media: {spm:.0f} ppm."
+            parts.append(f" Cadencia media: {spm:.0f} ppm.")
         else:
-             description += f" Cadencia media: {avg_cadence:.0f} rpm."
+             parts.append(f" Cadencia media: {avg_cadence:.0f} rpm.")
 
     # Add Heart Rate
     if avg_heartrate:
-         description += f" Frecuencia cardíaca media: {avg_heartrate:.0f} ppm."
+         parts.append(f" Frecuencia cardíaca media: {avg_heartrate:.0f} ppm.")
 
-    # Add Perceived Exertion
-    if perceived_exertion:
+    # Add Perceived Exertion (only present on detail payloads)
+    if include_details and perceived_exertion:
         rpe_desc = get_rpe_description(perceived_exertion)
-        description += f" Sensación: {rpe_desc} ({perceived_exertion:.0f}/10)."
+        if rpe_desc:
+            parts.append(f" Sensación: {rpe_desc} ({perceived_exertion:.0f}/10).")
 
     # Add Detailed Data (Splits and Zones) if applicable
     if show_details:
         # Splits
         splits = activity.get('splits_metric', [])
         if splits:
-            description += "\n\nDesglose por Km:"
+            parts.append("\n\nDesglose por Km:")
             for split in splits:
                 try:
                     split_num = split.get('split')
@@ -295,15 +539,12 @@ def format_activity(activity):
                     
                     s_hr = split.get('average_heartrate')
                     s_elev = split.get('elevation_difference', 0)
-                    
-                    line = f"- Km {split_num}: {s_pace}/km"
-                    if s_hr:
-                         line += f", {s_hr:.0f} ppm"
-                    
-                    elev_sign = "+" if s_elev >= 0 else ""
-                    line += f", {elev_sign}{s_elev:.0f}m"
-                    
-                    description += f"\n{line}"
+
+                    hr_part = f", {s_hr:.0f} ppm" if s_hr else ""
+                    parts.append(
+                        f"\n- Km {split_num}: {s_pace}/km{hr_part}"
+                        f", {'+' if s_elev >= 0 else ''}{s_elev:.0f}m"
+                    )
                 except Exception:
                     continue
 
@@ -316,24 +557,25 @@ def format_activity(activity):
                 if not buckets: continue
                 
                 if z_type == 'heartrate':
-                    description += "\n\nZonas de Frecuencia Cardíaca:"
+                    parts.append("\n\nZonas de Frecuencia Cardíaca:")
                 elif z_type == 'pace':
-                    description += "\n\nZonas de Ritmo:"
+                    parts.append("\n\nZonas de Ritmo:")
                 else:
                     continue
                 
-                total_time = sum(b.get('time', 0) for b in buckets)
+                # Pull the times out once; the same list feeds the total
+                # and the per-bucket loop.
+                times = [b.get('time', 0) for b in buckets]
+                total_time = sum(times)
                 if total_time == 0: continue
 
-                for i, b in enumerate(buckets):
-                    b_time = b.get('time', 0)
+                for i, (b, b_time) in enumerate(zip(buckets, times)):
                     if b_time == 0: continue
-                    
+
                     pct = (b_time / total_time) * 100
-                    
+
                     # Format time
-                    mins = int(b_time // 60)
-                    secs = int(b_time % 60)
+                    mins, secs = divmod(int(b_time), 60)
                     time_str = f"{mins}m {secs}s"
                     
                     # Range
@@ -341,19 +583,17 @@ def format_activity(activity):
                     z_max = b.get('max')
                     if z_max == -1: z_max = "+" # Open ended
                     
-                    description += f"\n- Z{i+1} ({z_min}-{z_max}): {time_str} ({pct:.0f}%)"
+                    parts.append(f"\n- Z{i+1} ({z_min}-{z_max}): {time_str} ({pct:.0f}%)")
 
-    return description
+    return ''.join(parts)
 
 def parse_activities_file(filepath):
     """
     Parses the file into a header and a dictionary of activities.
     Returns: (header_content, activities_dict)
-    activities_dict is an OrderedDict: { 'activity_id': 'description_text' }
+    activities_dict is an OrderedDict mapping int activity id to
+    description text.
     """
-    from collections import OrderedDict
-    import re
-
     activities = OrderedDict()
     header_lines = []
     
@@ -364,25 +604,23 @@ def parse_activities_file(filepath):
         with open(filepath, 'r', encoding='utf-8') as f:
             content = f.read()
             
-        # Split by the ID marker
-        # We need to capture the ID to use it as key
-        # Pattern: <!-- ID: 12345 -->
-        # We use a lookahead or just standard split and process chunks
-        
-        # Regex to find all ID markers
-        # We can split the text by the marker. 
-        # re.split('<!-- ID: (\d+) -->', content) will return:
-        # [header, id1, desc1, id2, desc2, ...]
-        parts = re.split(r'<!-- ID: (\d+) -->', content)
-        
+        # Split on the fixed '<!-- ID: N -->' marker with plain string ops;
+        # one C-level split plus a partition per record, no regex engine.
+        parts = content.split(ID_MARKER_PREFIX)
+
         # First part is the header (text before the first ID)
-        header = parts[0] if parts else ""
-        
-        # The rest come in pairs: ID, Description
-        for i in range(1, len(parts), 2):
-            act_id = parts[i]
-            desc = parts[i+1].strip()
-            activities[act_id] = desc
+        header = parts[0]
+        last_id = None
+        for chunk in parts[1:]:
+            id_text, sep, desc = chunk.partition(ID_MARKER_SUFFIX)
+            if sep and id_text.isdigit():
+                last_id = int(id_text)
+                activities[last_id] = desc.strip()
+            elif last_id is not None:
+                # Not a real marker; glue it back onto the previous record.
+                activities[last_id] += ID_MARKER_PREFIX + chunk
+            else:
+                header += ID_MARKER_PREFIX + chunk
 
         return header, activities
 
@@ -390,90 +628,244 @@ def parse_activities_file(filepath):
         print(f"Error reading existing file: {e}")
         return "", activities
 
-def save_activities(activities, access_token):
-    """Saves activities to the file, updating existing ones and appending new ones."""
-    header, existing_activities = parse_activities_file(OUTPUT_FILE)
-    
+def flush_log(lines):
+    """Writes buffered progress lines in one stdout call and clears them."""
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
+        lines.clear()
+
+def index_sidecar_path(filepath):
+    """Path of the sidecar index mapping activity id to its log location."""
+    return filepath + '.idx.json'
+
+def write_output_index(filepath, header_len, size, offsets):
+    """Rewrites the offset index. Best effort: the log itself stays canonical."""
+    payload = {
+        'size': size,
+        'header_len': header_len,
+        'ids': {str(act_id): list(span) for act_id, span in offsets.items()},
+    }
+    try:
+        data = (orjson.dumps(payload) if orjson is not None
+                else json.dumps(payload).encode('utf-8'))
+        with open(index_sidecar_path(filepath), 'wb') as f:
+            f.write(data)
+    except OSError as error:
+        print(f"Warning: could not write the activity index: {error}")
+
+def load_output_index(filepath):
+    """
+    Loads the offset index if it still matches the log on disk.
+    The recorded size catches hand edits and out-of-band rewrites; any
+    mismatch or unreadable index falls back to parsing the log.
+    """
+    try:
+        size = os.path.getsize(filepath)
+        with open(index_sidecar_path(filepath), 'rb') as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        if data.get('size') != size:
+            return None
+        return {
+            'header_len': data['header_len'],
+            'ids': {int(act_id): tuple(span) for act_id, span in data['ids'].items()},
+        }
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+def load_known_ids(filepath):
+    """
+    Loads the set of stored activity IDs.
+    The offset index answers this without scanning the log; when it is
+    missing or stale the log is parsed once instead.
+    """
+    index = load_output_index(filepath)
+    if index is not None:
+        return set(index['ids'])
+    _, activities = parse_activities_file(filepath)
+    return set(activities)
+
+def load_activities_log(filepath):
+    """
+    Returns (header, activities_dict) like parse_activities_file, but via
+    the offset index when it is valid: one read and O(ids) slicing, no
+    marker scanning.
+    """
+    index = load_output_index(filepath)
+    if index is not None:
+        try:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            header = data[:index['header_len']].decode('utf-8')
+            activities = OrderedDict(
+                (act_id, data[offset:offset + length].decode('utf-8'))
+                for act_id, (offset, length) in index['ids'].items()
+            )
+            return header, activities
+        except (OSError, UnicodeDecodeError):
+            pass
+    return parse_activities_file(filepath)
+
+def save_activities(activities, state):
+    """Saves activities to the file, updating existing ones and appending new ones.
+
+    The summary dicts in ``activities`` are consumed destructively: detail
+    payloads are merged into them in place.
+    """
+    known_ids = load_known_ids(OUTPUT_FILE)
+
     # Track if we made any changes to avoid unnecessary writes
     updates_made = False
-    
-    # Process activities
-    # We process reversed (oldest of the fetch first) so that if we are appending
-    # new consecutive activities, they appear in order.
-    for activity in reversed(activities):
-        # Filter out WeightTraining
-        act_type = activity.get('sport_type', activity.get('type', 'Unknown'))
-        if act_type == "WeightTraining":
-            continue
 
-        act_id = str(activity.get('id'))
-        
-        # Check if we already have it to decide on logging
-        is_update = act_id in existing_activities
-        
-        # Fetch details to get full data (RPE, etc.)
-        # Only print if it's new, to avoid spam, or finding changes?
-        # Let's print fetching...
-        if not is_update:
-             print(f"Fetching details for new activity {act_id}...")
+    # Excluded sport types were already dropped at fetch time. Known
+    # activities stay in, since they may carry updates. We process
+    # reversed (oldest of the fetch first) so that if we are appending
+    # new consecutive activities, they appear in order.
+    to_process = [(activity.get('id'), activity) for activity in reversed(activities)]
+
+    # Parse the log up front only when there are stored entries to compare;
+    # a batch of purely new activities still defers it past the network phase.
+    header = existing_activities = None
+    if any(act_id in known_ids for act_id, _ in to_process):
+        header, existing_activities = load_activities_log(OUTPUT_FILE)
+
+    # An update candidate whose stored description still starts with what
+    # the summary alone produces cannot have changed in any field we
+    # render from the summary, so its detail fetch is skipped and the
+    # stored text kept as-is.
+    # Per-activity progress goes through a buffer flushed in one stdout
+    # write instead of a syscall per line.
+    log_lines = []
+    skip_ids = set()
+    for act_id, activity in to_process:
+        if act_id in known_ids:
+            stored = existing_activities.get(act_id) if existing_activities else None
+            if stored and stored.startswith(format_activity(activity, include_details=False)):
+                skip_ids.add(act_id)
+                log_lines.append(f"Activity {act_id} unchanged, skipping detail fetch.")
+            else:
+                log_lines.append(f"Checking updates for activity {act_id}...")
         else:
-             print(f"Checking updates for activity {act_id}...")
+            log_lines.append(f"Fetching details for new activity {act_id}...")
+    flush_log(log_lines)
+
+    # Fetch details to get full data (RPE, etc.) for the whole batch at
+    # once; cached ETags turn unchanged activities into cheap 304s.
+    # Conditional requests are only safe for ids already stored in the
+    # log: a 304 for an id the file does not have would leave a
+    # summary-only record, so anything else fetches unconditionally even
+    # when the cache still holds its ETag.
+    etags, desc_hashes = load_cache()
+    details = fetch_details(
+        [act_id for act_id, _ in to_process if act_id not in skip_ids],
+        state,
+        {act_id: etag for act_id, etag in etags.items() if act_id in known_ids},
+    )
 
-        detail = get_activity_detail(act_id, access_token)
-        
-        full_activity = activity.copy()
-        full_activity.update(detail)
+    if existing_activities is None:
+        header, existing_activities = load_activities_log(OUTPUT_FILE)
+    prior_max = max(existing_activities, default=None)
+    changed_existing = False
+    added_ids = []
 
-        # Fetch Zones if it's a target activity (>= 17347409698)
-        try:
-            if int(act_id) >= 17347409698:
-                print(f"  -> Fetching zones for {act_id}...")
-                zones = get_zones(act_id, access_token)
-                if zones:
-                    full_activity['zones'] = zones
-        except (ValueError, TypeError):
-            pass
+    for act_id, activity in to_process:
+        if act_id in skip_ids:
+            continue
+        is_update = act_id in known_ids
+        detail, new_etag = details[act_id]
+        if new_etag:
+            etags[act_id] = new_etag
+        if detail is None and is_update:
+            # 304: the stored entry is current.
+            continue
+        # Merge the detail payload into the summary in place rather than
+        # building a merged copy; summary-only fields survive and no
+        # intermediate dict is constructed.
+        if detail:
+            activity |= detail
+
+        new_description = format_activity(activity)
+        new_hash = description_hash(new_description)
 
-        
-        new_description = format_activity(full_activity)
-        
         if is_update:
-            # Check if description changed
-            old_description = existing_activities[act_id]
-            if old_description != new_description:
-                print(f"  -> Updating activity {act_id}.")
+            # Change detection compares 64-bit description hashes instead
+            # of scanning the multi-KB strings; a missing hash (first run
+            # after a cache reset) is computed from the stored text once
+            # and persisted.
+            old_hash = desc_hashes.get(act_id)
+            if old_hash is None:
+                stored = existing_activities.get(act_id)
+                if stored is not None:
+                    old_hash = description_hash(stored)
+            if old_hash != new_hash:
+                log_lines.append(f"  -> Updating activity {act_id}.")
                 existing_activities[act_id] = new_description
                 updates_made = True
-            else:
-                pass # Unchanged
+                changed_existing = True
         else:
-            print(f"  -> Adding new activity {act_id}.")
+            log_lines.append(f"  -> Adding new activity {act_id}.")
             existing_activities[act_id] = new_description
             updates_made = True
-            
-        # Sleep briefly
-        time.sleep(1)
+            added_ids.append(act_id)
+        desc_hashes[act_id] = new_hash
+
+    flush_log(log_lines)
 
     if not updates_made:
+        # Nothing in the log changed, so the refreshed ETags and hashes
+        # already describe what is on disk.
+        if details:
+            save_cache(etags, desc_hashes)
         print("No changes detected.")
         return
 
-    # Sort activities by newest first (descending ID)
-    sorted_activities = sorted(existing_activities.items(), key=lambda x: int(x[0]), reverse=True)
+    # Newest first (descending ID). In the common daily sync only
+    # strictly-newer activities were added, so the stored entries are
+    # already in descending file order and the new ones just go on top;
+    # re-sorting the whole history is only needed for in-place updates or
+    # backfills.
+    # A mid-fetch pagination shift can hand us the same activity twice;
+    # dedupe so the fast path cannot write a record twice.
+    new_ids = sorted(set(added_ids), reverse=True)
+    if not changed_existing and new_ids and (prior_max is None or new_ids[-1] > prior_max):
+        added_set = set(new_ids)
+        ordered_ids = new_ids + [
+            act_id for act_id in existing_activities if act_id not in added_set
+        ]
+    else:
+        # Keys are ints, so this is a plain C-level sort with no key
+        # function.
+        ordered_ids = sorted(existing_activities, reverse=True)
 
     temp_path = None
     try:
         output_dir = os.path.dirname(OUTPUT_FILE) or '.'
-        with tempfile.NamedTemporaryFile(
-            mode='w', encoding='utf-8', dir=output_dir, delete=False
-        ) as f:
+        # Build the payload and the offset index in the same pass: each
+        # description is encoded once and the whole batch written in a
+        # single call.
+        header_bytes = header.encode('utf-8')
+        chunks = [header_bytes]
+        offsets = {}
+        position = len(header_bytes)
+        for act_id in ordered_ids:
+            marker = f"{ID_MARKER_PREFIX}{act_id}{ID_MARKER_SUFFIX}\n".encode('utf-8')
+            desc_bytes = existing_activities[act_id].encode('utf-8')
+            offsets[act_id] = (position + len(marker), len(desc_bytes))
+            chunks += (marker, desc_bytes, b'\n\n')
+            position += len(marker) + len(desc_bytes) + 2
+        payload = b''.join(chunks)
+        with tempfile.NamedTemporaryFile(mode='wb', dir=output_dir, delete=False) as f:
             temp_path = f.name
-            f.write(header)
-            for act_id, description in sorted_activities:
-                f.write(f"<!-- ID: {act_id} -->\n")
-                f.write(f"{description}\n\n")
+            f.write(payload)
         os.replace(temp_path, OUTPUT_FILE)
         temp_path = None
+        write_output_index(OUTPUT_FILE, len(header_bytes), len(payload), offsets)
+        # Persist the cache only once the log it describes is on disk: a
+        # cache saved ahead of a failed write would 304 forever against
+        # text that never made it into the file.
+        if details:
+            save_cache(etags, desc_hashes)
         print("File updated successfully.")
                 
     except IOError as error:
@@ -483,21 +875,20 @@ def save_activities(activities, access_token):
             os.unlink(temp_path)
 
 def main():
-    global API_CALLS
-    API_CALLS = 0
     parser = argparse.ArgumentParser(description="Strava Activity Sync")
     parser.add_argument("--all", action="store_true", help="Fetch all historical activities (pagination)")
     args = parser.parse_args()
 
     print("Starting Strava Sync...")
-    
+    state = RateState()
+
     try:
-        access_token = get_access_token()
+        get_access_token(state)
         print("Authentication successful.")
-        activities = get_activities(access_token, fetch_all=args.all)
+        activities = get_activities(state, fetch_all=args.all)
         if activities:
             print(f"Fetched {len(activities)} activities.")
-            save_activities(activities, access_token)
+            save_activities(activities, state)
         else:
             print("No activities found.")
         return 0
@@ -22,7 +22,7 @@ class ResponseSession:
 
 class StravaSyncTests(unittest.TestCase):
     def setUp(self):
-        main.API_CALLS = 0
+        self.state = main.RateState()
 
     def test_missing_credentials_raise_a_sync_error(self):
         with (
@@ -39,11 +39,11 @@ class StravaSyncTests(unittest.TestCase):
     def test_activity_fetch_error_is_not_silently_ignored(self):
         with patch.object(main, 'SESSION', ResponseSession(503)):
             with self.assertRaises(main.StravaSyncError):
-                main.get_activities('token')
+                main.get_activities(self.state)
 
     def test_missing_zones_are_an_expected_empty_result(self):
         with patch.object(main, 'SESSION', ResponseSession(404)):
-            self.assertEqual(main.get_zones('123', 'token'), [])
+            self.assertEqual(main.get_zones('123', self.state), [])
 
     def test_detail_failure_does_not_replace_output(self):
         with tempfile.TemporaryDirectory() as directory:
@@ -60,10 +60,52 @@ class StravaSyncTests(unittest.TestCase):
                 ),
             ):
                 with self.assertRaises(main.StravaSyncError):
-                    main.save_activities([activity], 'token')
+                    main.save_activities([activity], self.state)
 
             self.assertEqual(output.read_text(encoding='utf-8'), 'existing data\n')
 
+    def test_unchanged_summary_skips_the_detail_fetch(self):
+        activity = {
+            'id': 123,
+            'sport_type': 'Run',
+            'distance': 5000,
+            'moving_time': 1500,
+            'start_date_local': '2026-07-11T08:30:00Z',
+        }
+        stored = main.format_activity(activity, include_details=False) + ' Sensación: Duro (7/10).'
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'entrenamientos_contexto.txt'
+            output.write_text(f"<!-- ID: 123 -->\n{stored}\n\n", encoding='utf-8')
+
+            with (
+                patch.object(main, 'OUTPUT_FILE', str(output)),
+                patch.object(
+                    main,
+                    'get_activity_detail',
+                    side_effect=AssertionError('detail fetch should be skipped'),
+                ),
+            ):
+                main.save_activities([activity], self.state)
+
+            self.assertIn(stored, output.read_text(encoding='utf-8'))
+
+    def test_parse_activities_file_round_trips_header_and_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'entrenamientos_contexto.txt'
+            output.write_text(
+                'Cabecera del fichero.\n\n'
+                '<!-- ID: 200 -->\nSegunda actividad.\n\n'
+                '<!-- ID: 100 -->\nPrimera actividad.\n\n',
+                encoding='utf-8',
+            )
+            header, activities = main.parse_activities_file(str(output))
+
+            self.assertEqual(header, 'Cabecera del fichero.\n\n')
+            self.assertEqual(
+                activities,
+                {200: 'Segunda actividad.', 100: 'Primera actividad.'},
+            )
+
     def test_iso_dates_with_or_without_z_are_supported(self):
         base = {
             'sport_type': 'Run',